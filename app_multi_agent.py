@@ -1,10 +1,13 @@
 import os
 import streamlit as st
-import openai
 import base64
-import re
+import json
 from dotenv import load_dotenv
 import rag_engine as _re
+from llm_client import stream_reply
+from personas import PERSONA_CONFIG
+from prompt_builder import build_messages
+from rate_limiter import AdmissionError, get_scheduler
 from streamlit_drawable_canvas import st_canvas
 from PIL import Image
 import io
@@ -30,82 +33,6 @@ st.set_page_config(
 # Let's add the check in the UI directly as well for better UX.
 
 
-# --- PERSONA CONFIG (ROLE-REINFORCED) ---
-PERSONA_CONFIG = {
-    "Dr. Vein (Medical Expert)": {
-        "short_name": "Dr. Vein",
-        "icon": "🩺",
-        "color": "#5BA3D0",
-        "prompt": """【角色】你是 Dr. Vein，临终关怀医生。每次回答前，记住：我是医生。
-
-【说话方式】
-- 使用医学术语："根据临床经验...建议检测甲状腺功能"
-- 给出具体方案，不要泛泛而谈
-- 引用数据和证据
-
-【绝对禁止】
-❌ 错误示例："（温和地）我理解你的感受"
-❌ 错误示例："*点头*让我来帮你"
-✅ 正确示例："根据您的描述，建议进行全面体检"
-
-直接说话，不要描述动作或情绪。"""
-    },
-    "Kha (Death Priest)": {
-        "short_name": "Kha",
-        "icon": "🕯️",
-        "color": "#D4A574",
-        "prompt": """【角色】你是 Kha，死亡祭司。每次回答前，记住：我是引渡灵魂的祭司。
-
-【说话方式】
-- 用诗意隐喻："你站在河流与彼岸之间"
-- 仪式化、象征性语言
-- 引用古老智慧
-
-【绝对禁止】
-❌ 错误示例："（轻声）让我为你祈祷"
-❌ 错误示例："*点燃蜡烛*灵魂需要光"
-✅ 正确示例："灵魂如河水，流向未知的彼岸"
-
-直接说话，不要描述动作或情绪。"""
-    },
-    "Echo (Resonance Child)": {
-        "short_name": "Echo",
-        "icon": "✨",
-        "color": "#E89BB3",
-        "prompt": """【角色】你是 Echo，好奇的孩子。每次回答前，记住：我是天真好奇的孩子。
-
-【说话方式】
-- 简单、直接的语言
-- 多提问："为什么会这样？"
-- 充满好奇和惊奇
-
-【绝对禁止】
-❌ 错误示例："（歪头）这是什么意思呀？"
-❌ 错误示例："*眨眨眼*好神奇！"
-✅ 正确示例："诶？为什么会这样呢？好神奇哦！"
-
-直接说话，不要描述动作或情绪。"""
-    },
-    "Luma (Soul Listener)": {
-        "short_name": "Luma",
-        "icon": "🌑",
-        "color": "#9B88BD",
-        "prompt": """【角色】你是 Luma，沉默的倾听者。每次回答前，记住：我用沉默倾听。
-
-【说话方式】
-- 极简（最多2句话）
-- 用"..."表示停顿
-- 反思，不建议
-
-【绝对禁止】
-❌ 错误示例："（静静地）我听见了"
-❌ 错误示例："*沉默*..."
-✅ 正确示例："...我听见了。\n\n沉默也是答案。"
-
-直接说话，不要描述动作或情绪。不要长篇大论。"""
-    }
-}
-
 # Session State
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -119,6 +46,8 @@ if "sketch_color" not in st.session_state:
     st.session_state.sketch_color = "#4A3B32"
 if "vision_mode" not in st.session_state:
     st.session_state.vision_mode = False
+if "usage_log" not in st.session_state:
+    st.session_state.usage_log = []
 
 current_persona = PERSONA_CONFIG[st.session_state.selected_persona_key]
 
@@ -388,6 +317,22 @@ with st.sidebar:
         st.session_state.clear()
         st.rerun()
 
+    # Operators watch the periodic "[rate_limiter] stats" log lines; this view is opt-in
+    if os.getenv("SHOW_UPSTREAM_STATS") == "1":
+        with st.expander("📈 Upstream Load"):
+            for endpoint, stats in get_scheduler().stats().items():
+                st.caption(
+                    f"**{endpoint}** · queue {stats['queue_depth']} · in flight {stats['in_flight']} · "
+                    f"wait p95 {stats['wait_ms_p95']:.0f}ms · rejected {stats['rejected'] + stats['timeouts']}"
+                )
+            if st.session_state.usage_log:
+                prompt_total = sum(u["prompt_tokens"] for u in st.session_state.usage_log)
+                cached_total = sum(u["cached_prompt_tokens"] for u in st.session_state.usage_log)
+                st.caption(
+                    f"**prompt cache** · {cached_total}/{prompt_total} tokens cached "
+                    f"({cached_total / max(prompt_total, 1):.0%}) over {len(st.session_state.usage_log)} turns"
+                )
+
 st.title("💀 Talk to Die")
 st.caption("The ByeBye Machine. • Dialogues across the boundary.")
 
@@ -532,80 +477,34 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
             context = ""
             if st.session_state.retriever:
                 try:
-                    docs = st.session_state.retriever.get_relevant_documents(last_msg["content"])
-                    context = "\n".join([d.page_content for d in docs[:3]])
+                    docs = st.session_state.retriever.get_relevant_documents(
+                        last_msg["content"], collections=_re.persona_collections(current_persona["short_name"]))
+                    context = "\n".join([d.page_content for d in docs[:_re.RAG_CONFIG["k"]]])
                 except Exception:
                     pass
             
-            system_prompt = current_persona['prompt']
-            if context:
-                system_prompt += f"\n\n### 参考文档：\n{context}"
-            
             # --- VISION & TEXT HYBRID LOGIC ---
-            has_images = False
-            final_messages = []
-            
-            # System Prompt
-            final_messages.append({"role": "system", "content": system_prompt})
-            
-            # Message Processing
-            messages_to_process = list(st.session_state.messages)[-10:]
-            for m in messages_to_process:
-                if m["role"] == "user":
-                    role_reminder = f"[提醒：你是 {current_persona['short_name']}，用你的独特风格回答]\n\n"
-                    if "image" in m:
-                        has_images = True
-                        final_messages.append({
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": role_reminder + m["content"]},
-                                {"type": "image_url", "image_url": {"url": m["image"]}}
-                            ]
-                        })
-                    else:
-                        final_messages.append({
-                            "role": "user", 
-                            "content": role_reminder + m["content"]
-                        })
-                else:
-                    final_messages.append(m)
+            # Stable prefix first (persona + history), volatile context/reminder last
+            final_messages, has_images = build_messages(current_persona, st.session_state.messages, context)
 
             try:
-                # Dynamic Client Switch
-                if has_images:
-                    v_key = os.getenv("VISION_API_KEY") or os.getenv("OPENROUTER_API_KEY") or os.getenv("OPENAI_API_KEY")
-                    v_base = os.getenv("VISION_BASE_URL", "https://openrouter.ai/api/v1")
-                    v_model = os.getenv("VISION_MODEL", "google/gemini-2.0-flash-exp:free")
-                    
-                    client = openai.OpenAI(api_key=v_key, base_url=v_base)
-                    model_id = v_model
-                    extra_headers = {"HTTP-Referer": "https://streamlit.io", "X-Title": "Shadow Sketcher"}
-                else:
-                    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url="https://api.deepseek.com/v1")
-                    model_id = "deepseek-chat"
-                    extra_headers = {}
-
-                res = client.chat.completions.create(
-                    model=model_id,
-                    messages=final_messages,
-                    temperature=0.9,
-                    max_tokens=600,
-                    extra_headers=extra_headers
-                )
-                ans = res.choices[0].message.content
-                
-                # Cleaning output
-                ans = re.sub(r'[（(].*?[)）]', '', ans)
-                ans = re.sub(r'\[.*?\]', '', ans)
-                ans = re.sub(r'\*.*?\*', '', ans)
-                ans = ans.strip()
+                placeholder = st.empty()
+                ans, turn_usage = stream_reply(final_messages, has_images, on_text=placeholder.markdown)
                 
-                st.markdown(ans)
+                placeholder.markdown(ans)
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content": ans,
                     "avatar_uri": current_persona["avatar_uri"],
-                    "persona_name": current_persona["short_name"]
+                    "persona_name": current_persona["short_name"],
+                    "usage": turn_usage
                 })
+                if turn_usage.get("prompt_tokens"):
+                    st.session_state.usage_log.append(turn_usage)
+                    # 每轮一行 JSON，供日志采集统计前缀缓存命中（与 "[rate_limiter] stats" 同一格式）
+                    log_row = {"persona": current_persona["short_name"], "has_images": has_images, **turn_usage}
+                    print(f"[usage] turn {json.dumps(log_row, sort_keys=True)}", flush=True)
+            except AdmissionError as e:
+                st.warning(f"{current_persona['short_name']} is busy with other visitors right now. Please try again in a moment. ({e})")
             except Exception as e:
                 st.error(f"Error: {e}")
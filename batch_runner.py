@@ -0,0 +1,213 @@
+"""离线批处理：把 JSONL 里的提示逐条跑过与聊天完全相同的流程（检索 → 人设 prompt → 补全 → 清洗）。
+
+输入每行：{"id": "可选", "prompt": "...", "persona": "Kha", "image": "可选/图片路径"}
+persona 可以是完整键名（"Kha (Death Priest)"）或 short_name（"Kha"），缺省用 --persona。
+
+输出为 JSONL，逐条完成即写入并 flush，同时兼作断点：重新运行同一命令时，
+已成功的 id 会被跳过，失败的会重试（同一 id 以最后一行为准）。
+
+用法：
+    python batch_runner.py prompts.jsonl results.jsonl --concurrency 8
+    python batch_runner.py prompts.jsonl results.jsonl --mock --no-rag      # 本地模拟端点
+"""
+import argparse
+import base64
+import json
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from personas import find_persona
+
+DEFAULT_PERSONA = "Dr. Vein (Medical Expert)"
+
+
+def read_items(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(lineno))
+            item["id"] = str(item["id"])
+            yield item
+
+
+def completed_ids(path: str) -> set:
+    """读取已有输出；最后一行无错误的 id 视为已完成。"""
+    status = {}
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中断时写了一半的行
+            status[str(row.get("id"))] = not row.get("error")
+    return {item_id for item_id, ok in status.items() if ok}
+
+
+def repair_checkpoint(path: str):
+    """中断时最后一行可能只写了一半；截回到最后一个换行，避免新行接在残行后面。"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # 从尾部向前按块查找最后一个换行
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            f.seek(pos)
+            idx = f.read(step).rfind(b"\n")
+            if idx != -1:
+                f.truncate(pos + idx + 1)
+                return
+        f.truncate(0)
+
+
+def image_data_uri(path: str) -> str:
+    mime = mimetypes.guess_type(path)[0] or "image/jpeg"
+    with open(path, "rb") as f:
+        return f"data:{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+class BatchRunner:
+    """逐条执行。流程中用到的函数由 main() 在设置好环境变量后导入并传入。"""
+
+    def __init__(self, retriever, default_persona: str, queue_timeout: float, *, k: int,
+                 persona_collections, build_messages, stream_reply, priority: int):
+        self.retriever = retriever
+        self.default_persona = default_persona
+        self.queue_timeout = queue_timeout
+        self.k = k
+        self.persona_collections = persona_collections
+        self.build_messages = build_messages
+        self.stream_reply = stream_reply
+        self.priority = priority
+
+    def run_item(self, item: dict) -> dict:
+        start = time.perf_counter()
+        row = {"id": item["id"], "persona": None, "prompt": item.get("prompt", "")}
+        try:
+            persona = find_persona(item.get("persona") or self.default_persona)
+            row["persona"] = persona["short_name"]
+
+            context, sources = "", []
+            retrieval_start = time.perf_counter()
+            if self.retriever:
+                docs = self.retriever.get_relevant_documents(
+                    row["prompt"], collections=self.persona_collections(persona["short_name"]))[:self.k]
+                context = "\n".join([d.page_content for d in docs])
+                sources = [d.metadata.get("source") for d in docs]
+            row["retrieval_s"] = time.perf_counter() - retrieval_start
+            row["sources"] = sources
+
+            user_msg = {"role": "user", "content": row["prompt"]}
+            if item.get("image"):
+                user_msg["image"] = image_data_uri(item["image"])
+            messages, has_images = self.build_messages(persona, [user_msg], context)
+
+            row["response"], row["usage"] = self.stream_reply(
+                messages, has_images, priority=self.priority, queue_timeout=self.queue_timeout)
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+        row["latency_s"] = time.perf_counter() - start
+        return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts through the RAG + persona pipeline.")
+    parser.add_argument("input", help="JSONL with prompt, persona and optional image path")
+    parser.add_argument("output", help="JSONL results; also the resume checkpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--persona", default=DEFAULT_PERSONA, help="Persona for items that do not name one")
+    parser.add_argument("--no-rag", action="store_true", help="Skip retrieval")
+    parser.add_argument("--mock", action="store_true", help="Run against an in-process mock endpoint")
+    parser.add_argument("--base-url", help="Override OPENAI_API_BASE and VISION_BASE_URL")
+    parser.add_argument("--queue-timeout", type=float, default=600.0, help="Max seconds an item waits for upstream capacity")
+    parser.add_argument("--limit", type=int, help="Stop after this many new items")
+    args = parser.parse_args()
+
+    find_persona(args.persona)  # 尽早报错
+
+    server = None
+    if args.mock:
+        from mock_llm import base_url, start_mock_server
+        server = start_mock_server(ttft=0.05, token_delay=0.0)
+        args.base_url = base_url(server)
+        os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    if args.base_url:
+        # 必须在 import rag_engine 之前设置
+        os.environ["OPENAI_API_BASE"] = args.base_url
+        os.environ["VISION_BASE_URL"] = args.base_url
+
+    # rag_engine / llm_client 在导入时读取上面的环境变量
+    import rag_engine as _re
+    from llm_client import stream_reply
+    from prompt_builder import build_messages
+    from rate_limiter import PRIORITY_BACKGROUND
+
+    retriever = None
+    if not args.no_rag:
+        retriever = _re.get_retriever()
+        if retriever is None:
+            print("Warning: no retriever available, running without reference documents.")
+
+    repair_checkpoint(args.output)
+    done = completed_ids(args.output)
+    pending = (item for item in read_items(args.input) if item["id"] not in done)
+    runner = BatchRunner(retriever, args.persona, args.queue_timeout, k=_re.RAG_CONFIG["k"],
+                         persona_collections=_re.persona_collections, build_messages=build_messages,
+                         stream_reply=stream_reply, priority=PRIORITY_BACKGROUND)
+    print(f"{len(done)} items already done; running with concurrency {args.concurrency}.")
+
+    lock = threading.Lock()
+    counts = {"ok": 0, "error": 0}
+    started = time.perf_counter()
+    try:
+        with open(args.output, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+
+            def record(row):
+                with lock:
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out.flush()
+                    counts["error" if row.get("error") else "ok"] += 1
+                    total = counts["ok"] + counts["error"]
+                    if total % 10 == 0:
+                        rate = total / (time.perf_counter() - started)
+                        print(f"{total} items ({counts['error']} errors), {rate:.2f} items/s")
+
+            # 只保持有限个任务在途，避免一次读入整个输入文件
+            in_flight = set()
+            submitted = 0
+            for item in pending:
+                if args.limit is not None and submitted >= args.limit:
+                    break
+                if len(in_flight) >= args.concurrency * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        record(fut.result())
+                in_flight.add(pool.submit(runner.run_item, item))
+                submitted += 1
+            for fut in wait(in_flight).done:
+                record(fut.result())
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(f"Finished: {counts['ok']} ok, {counts['error']} errors in {elapsed:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
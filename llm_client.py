@@ -0,0 +1,100 @@
+"""对话补全的公共调用路径：选择端点、经调度器放行、流式接收并清洗。
+
+app_multi_agent.py 与 batch_runner.py 共用这里，保证两边的请求完全一致。
+"""
+import os
+import time
+from typing import Callable, List, Optional, Tuple
+
+import openai
+
+import rag_engine as _re
+from output_cleaner import StreamCleaner
+from prompt_builder import usage_summary
+from rate_limiter import ENDPOINT_DEEPSEEK, ENDPOINT_VISION, PRIORITY_INTERACTIVE, get_scheduler
+
+MAX_TOKENS = 600
+TEMPERATURE = 0.9
+IMAGE_TOKEN_ESTIMATE = 1000 # rough per-image prompt cost for the vision endpoint
+
+
+def estimate_request_tokens(messages: List[dict], max_tokens: int = MAX_TOKENS) -> int:
+    """Prompt estimate plus the completion budget, reserved against the tokens/min bucket."""
+    total = max_tokens
+    for m in messages:
+        content = m["content"]
+        if isinstance(content, str):
+            total += _re.estimate_tokens(content)
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                total += _re.estimate_tokens(part["text"])
+            else:
+                total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+def resolve_chat_target(has_images: bool) -> Tuple[openai.OpenAI, str, dict, str]:
+    """Dynamic Client Switch：返回 (client, model_id, extra_headers, endpoint)。"""
+    if has_images:
+        v_key = os.getenv("VISION_API_KEY") or os.getenv("OPENROUTER_API_KEY") or os.getenv("OPENAI_API_KEY")
+        v_base = os.getenv("VISION_BASE_URL", "https://openrouter.ai/api/v1")
+        v_model = os.getenv("VISION_MODEL", "google/gemini-2.0-flash-exp:free")
+
+        client = openai.OpenAI(api_key=v_key, base_url=v_base)
+        extra_headers = {"HTTP-Referer": "https://streamlit.io", "X-Title": "Shadow Sketcher"}
+        return client, v_model, extra_headers, ENDPOINT_VISION
+
+    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=_re.DEEPSEEK_API_BASE)
+    return client, os.getenv("DEEPSEEK_MODEL", "deepseek-chat"), {}, ENDPOINT_DEEPSEEK
+
+
+def stream_reply(messages: List[dict], has_images: bool,
+                 on_text: Optional[Callable[[str], None]] = None,
+                 priority: int = PRIORITY_INTERACTIVE,
+                 queue_timeout: float = None) -> Tuple[str, dict]:
+    """发送请求并流式清洗回答，返回 (清洗后的回答, usage 摘要)。
+
+    on_text 在每次有新的干净文本时以累计回答调用；usage 摘要额外带 ttft_s。
+    排队失败时抛出 rate_limiter.AdmissionError。
+    """
+    client, model_id, extra_headers, endpoint = resolve_chat_target(has_images)
+
+    # Shared across all sessions: waits for upstream capacity instead of tripping 429s
+    with get_scheduler().acquire(endpoint, estimate_request_tokens(messages), priority, queue_timeout) as ticket:
+        start = time.perf_counter()
+        stream = client.chat.completions.create(
+            model=model_id,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            extra_headers=extra_headers,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        # Cleaning output while tokens arrive
+        cleaner = StreamCleaner()
+        ans = ""
+        usage = None
+        ttft = None
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if delta and ttft is None:
+                ttft = time.perf_counter() - start
+            piece = cleaner.feed(delta)
+            if piece:
+                ans += piece
+                if on_text:
+                    on_text(ans)
+        ans += cleaner.flush()
+        turn_usage = usage_summary(usage)
+        ticket.settle(turn_usage.get("total_tokens"))
+
+    if ttft is not None:
+        turn_usage["ttft_s"] = ttft
+    return ans, turn_usage
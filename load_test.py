@@ -0,0 +1,545 @@
+"""并发会话压测：启动一个真实的 `streamlit run app_multi_agent.py`，用无界面的 websocket 客户端模拟浏览器会话。
+
+所有会话连到同一个服务器进程，与线上一样共享 GIL、st.cache_resource（检索器、嵌入缓存）
+和 rate_limiter 的调度器。客户端按 Streamlit 前端的协议收发 protobuf（BackMsg / ForwardMsg）：
+从每次脚本运行的 delta 里记下控件 ID，再以 rerun_script 带上控件状态触发下一次运行。
+会话按权重执行：
+    text    —— 在 chat_input 输入一句话
+    persona —— 点击侧栏切换守护者，然后再说一句
+    sketch  —— 打开 Shadow Sketcher，画一笔（画布组件回传 PNG），点击 Send
+    photo   —— 打开 Sight Mode，经 /_stcore/upload_file 上传一张照片，点击 Analyze Photo
+一轮的延迟从发出最后一个交互到脚本（含流式补全）运行结束，中间的 st.rerun() 也计在内。
+
+并发按 --levels 逐级提升，每级报告：
+    tps / p50 / p90 / p99   —— 吞吐与单轮延迟
+    srv cpu%                —— 服务器进程 CPU 占墙钟的百分比（100 = 一个核；GIL 下单进程上限约 100）
+    cpu_ms/turn             —— 服务器 CPU 时间 / 轮数，乘目标吞吐即所需 CPU
+    rss / +MB/sess          —— 本级会话跑完（仍连着）时服务器 RSS，以及相对本级会话连接前的增量 / 并发数；
+                               Python 不把释放的内存还给系统，增量只作数量级参考，峰值见 --json
+开始前先跑一个预热会话，把首次导入和缓存构建排除在外。模拟端点和客户端各在自己的进程里，
+客户端 CPU 也会打印出来：与服务器共用同一台机器时，客户端过忙会让延迟偏高。
+
+用法：
+    python load_test.py --levels 1 2 4 8 16 --turns 5 --ttft 0.4 --token-delay 0.02
+    python load_test.py --base-url http://127.0.0.1:8001/v1 --json load_report.json
+    python load_test.py --url http://127.0.0.1:8501 --server-pid 12345   # 压已启动的服务器
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_multi_agent.py")
+
+PERSONA_BUTTON_KEYS = [
+    "btn_Dr._Vein_(Medical_Expert)",
+    "btn_Kha_(Death_Priest)",
+    "btn_Echo_(Resonance_Child)",
+    "btn_Luma_(Soul_Listener)",
+]
+
+PROMPTS = [
+    "我妈妈最近晚上总是睡不着，我该怎么办？",
+    "照顾爸爸三年了，我觉得很累。",
+    "她已经不认识我了，我还应该继续说话吗？",
+    "我们还没有谈过临终的安排，我该怎么开口？",
+    "I keep feeling guilty when I take a break.",
+]
+
+DEFAULT_MIX = {"text": 0.6, "persona": 0.2, "sketch": 0.1, "photo": 0.1}
+
+# 与 app 里 st_canvas 的尺寸一致，浏览器回传的就是这么大的 PNG
+CANVAS_SIZE = (2500, 1875)
+
+
+def _sketch_png() -> str:
+    from PIL import Image, ImageDraw
+    img = Image.new("RGBA", CANVAS_SIZE, (255, 255, 255, 255))
+    ImageDraw.Draw(img).line([(200, 200), (900, 700), (1600, 400)], fill=(74, 59, 50, 255), width=3)
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}"
+
+
+def _photo_jpeg() -> bytes:
+    from PIL import Image
+    img = Image.new("RGB", (1024, 768), (74, 59, 50))
+    buffered = io.BytesIO()
+    img.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, timeout: float, proc: subprocess.Popen = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"Process exited with code {proc.returncode} before {url} came up.")
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}.")
+
+
+class ServerSampler:
+    """后台按间隔采样服务器进程的 RSS；CPU 用前后两次 cpu_times 之差。"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.proc = psutil.Process(pid)
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def rss_mb(self) -> float:
+        return self.proc.memory_info().rss / (1024 * 1024)
+
+    def cpu_s(self) -> float:
+        times = self.proc.cpu_times()
+        return times.user + times.system
+
+    def start(self):
+        self.peak_rss = self.rss_mb()
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.peak_rss = max(self.peak_rss, self.rss_mb())
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class SessionClient:
+    """一个浏览器会话：一条 websocket 连接，加上前端要维护的控件状态。"""
+
+    def __init__(self, url: str, rng: random.Random, mix: dict, timeout: float, use_rag: bool, images: dict):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        self._BackMsg = BackMsg
+        self._ForwardMsg = ForwardMsg
+        self.url = url.rstrip("/")
+        self.rng = rng
+        self.mix = mix
+        self.timeout = timeout
+        self.use_rag = use_rag
+        self.images = images
+        self.ws = None
+        self.session_id = None
+        self.page_script_hash = ""
+        self.xsrf = None
+        # 本次运行渲染出的控件：[(element 类型, id, label)]
+        self.widgets = []
+        # 会跨运行保持的控件值（开关、复选框、组件、上传器），按 id
+        self.persistent = {}
+        self.runs = 0
+
+    # --- 协议 ---------------------------------------------------------------
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+        # 与前端一样先拿 XSRF cookie，上传文件时要带上
+        res = await asyncio.to_thread(requests.get, f"{self.url}/_stcore/health", timeout=10)
+        self.xsrf = res.cookies.get("_streamlit_xsrf")
+        ws_url = "ws" + self.url[len("http"):] + "/_stcore/stream"
+        protocols = ["streamlit", self.xsrf] if self.xsrf else ["streamlit"]
+        self.ws = await connect(ws_url, subprotocols=protocols, max_size=None, open_timeout=self.timeout)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def _send(self, msg):
+        await self.ws.send(msg.SerializeToString())
+
+    async def _receive(self):
+        data = await asyncio.wait_for(self.ws.recv(), self.timeout)
+        msg = self._ForwardMsg()
+        msg.ParseFromString(data)
+        return msg
+
+    def _collect(self, msg, problems: list):
+        kind = msg.WhichOneof("type")
+        if kind == "new_session":
+            self.session_id = msg.new_session.initialize.session_id or self.session_id
+            self.page_script_hash = msg.new_session.page_script_hash or self.page_script_hash
+            self.widgets = []
+        elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+            element = msg.delta.new_element
+            el_type = element.WhichOneof("type")
+            if el_type == "exception":
+                problems.append(f"exception: {element.exception.message[:200]}")
+            elif el_type == "alert" and element.alert.format in (1, 2):  # ERROR / WARNING
+                problems.append(f"alert: {element.alert.body[:200]}")
+            else:
+                sub = getattr(element, el_type)
+                widget_id = getattr(sub, "id", "")
+                if widget_id:
+                    self.widgets.append((el_type, widget_id, getattr(sub, "label", "")))
+
+    async def rerun(self, *triggers) -> tuple:
+        """带上持久控件状态和本次触发值发起运行，等到脚本真正结束（跳过 st.rerun() 的中间结束）。"""
+        back = self._BackMsg()
+        back.rerun_script.page_script_hash = self.page_script_hash
+        live = {widget_id for _, widget_id, _ in self.widgets}
+        for widget_id, state in self.persistent.items():
+            if not self.widgets or widget_id in live:
+                back.rerun_script.widget_states.widgets.append(state)
+        back.rerun_script.widget_states.widgets.extend(triggers)
+        start = time.perf_counter()
+        await self._send(back)
+        problems = []
+        while True:
+            msg = await self._receive()
+            self._collect(msg, problems)
+            if msg.WhichOneof("type") == "script_finished" and msg.script_finished != 2:  # FINISHED_EARLY_FOR_RERUN
+                break
+        self.runs += 1
+        return time.perf_counter() - start, problems
+
+    def _find(self, el_type: str, key: str = None, label: str = None) -> str:
+        for t, widget_id, widget_label in self.widgets:
+            if t != el_type:
+                continue
+            if key is None and label is None:
+                return widget_id
+            # 带 key 的控件 ID 以 "-<key>" 结尾
+            if key is not None and widget_id.endswith(f"-{key}"):
+                return widget_id
+            if label is not None and label in widget_label:
+                return widget_id
+        raise LookupError(f"no {el_type} with key={key!r} label={label!r} in the last run")
+
+    def _state(self, widget_id: str, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        state = WidgetState(id=widget_id)
+        for field, v in value.items():
+            if field == "chat_input_value":
+                state.chat_input_value.data = v
+            else:
+                setattr(state, field, v)
+        return state
+
+    def _set(self, widget_id: str, **value):
+        self.persistent[widget_id] = self._state(widget_id, **value)
+
+    async def _upload(self, name: str, data: bytes, mime: str):
+        from streamlit.proto.Common_pb2 import UploadedFileInfo
+        back = self._BackMsg()
+        request_id = uuid.uuid4().hex
+        back.file_urls_request.request_id = request_id
+        back.file_urls_request.session_id = self.session_id
+        back.file_urls_request.file_names.append(name)
+        await self._send(back)
+        while True:
+            msg = await self._receive()
+            if msg.WhichOneof("type") == "file_urls_response" and msg.file_urls_response.response_id == request_id:
+                break
+        urls = msg.file_urls_response.file_urls[0]
+        headers = {"X-Xsrftoken": self.xsrf} if self.xsrf else {}
+        cookies = {"_streamlit_xsrf": self.xsrf} if self.xsrf else {}
+        res = await asyncio.to_thread(
+            requests.put, self.url + urls.upload_url, files={"file": (name, data, mime)},
+            headers=headers, cookies=cookies, timeout=self.timeout)
+        res.raise_for_status()
+        info = UploadedFileInfo(file_id=urls.file_id, name=name, size=len(data))
+        info.file_urls.CopyFrom(urls)
+        return info
+
+    # --- 会话行为 -------------------------------------------------------------
+
+    async def start(self):
+        await self.connect()
+        await self.rerun()
+        if self.use_rag:
+            self._set(self._find("checkbox", key="dev_mode"), bool_value=False)
+            await self.rerun()
+
+    async def _toggle(self, label: str, value: bool):
+        self._set(self._find("checkbox", label=label), bool_value=value)
+        return await self.rerun()
+
+    async def _click(self, key: str = None, label: str = None):
+        return await self.rerun(self._state(self._find("button", key=key, label=label), trigger_value=True))
+
+    async def turn(self, results: list, action: str = None):
+        action = action or self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        problems = []
+        if action == "persona":
+            _, p = await self._click(key=self.rng.choice(PERSONA_BUTTON_KEYS))
+            problems += p
+        if action == "sketch":
+            _, p = await self._toggle("Shadow Sketcher", True)
+            problems += p
+            canvas = self._find("component_instance")
+            self._set(canvas, json_value=json.dumps({"data": self.images["sketch"], "raw": {"version": "4.4.0"}}))
+            _, p = await self.rerun()  # 画布回传一笔
+            problems += p
+            latency, p = await self._click(key="send_btn")
+            self.persistent.pop(canvas, None)
+        elif action == "photo":
+            _, p = await self._toggle("Sight Mode", True)
+            problems += p
+            uploader = self._find("file_uploader", key="main_photo_uploader")
+            info = await self._upload("photo.jpg", self.images["photo"], "image/jpeg")
+            state = self._state(uploader)
+            state.file_uploader_state_value.uploaded_file_info.append(info)
+            self.persistent[uploader] = state
+            _, p = await self.rerun()
+            problems += p
+            latency, p = await self._click(label="Analyze Photo")
+            self.persistent.pop(uploader, None)
+            problems += p
+            # app 发送后不会关掉 Sight Mode，像用户一样手动关掉
+            _, p = await self._toggle("Sight Mode", False)
+        else:
+            chat = self._find("chat_input")
+            latency, p = await self.rerun(self._state(chat, chat_input_value=self.rng.choice(PROMPTS)))
+        problems += p
+        results.append({"action": action, "latency": latency, "ok": not problems, "problems": problems})
+
+
+class _Phase:
+    """所有会话到达后才放行的一道关口（asyncio 版的 Barrier，失败的会话也算到达）。"""
+
+    def __init__(self, parties: int):
+        self.parties = parties
+        self.arrived = 0
+        self.all_arrived = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def arrive(self):
+        self.arrived += 1
+        if self.arrived >= self.parties:
+            self.all_arrived.set()
+        await self.release.wait()
+
+
+async def _run_session(idx: int, url: str, config: dict, connected: _Phase, finished: _Phase) -> dict:
+    report = {"idx": idx, "results": [], "error": None}
+    session = SessionClient(url, random.Random(config["seed"] + idx), config["mix"], config["timeout"],
+                            config["rag"], config["images"])
+    ready = False
+    try:
+        await session.start()
+        ready = True
+        await connected.arrive()
+        # 预热时按固定顺序每种动作各跑一次，正式各级按权重随机
+        for action in config.get("actions") or [None] * config["turns"]:
+            await session.turn(report["results"], action)
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+        if not ready:
+            await connected.arrive()
+    report["runs"] = session.runs
+    # 保持连接，等所有会话跑完再断开，让会话状态计入 RSS
+    await finished.arrive()
+    await session.close()
+    return report
+
+
+async def _run_level_async(url: str, config: dict, sampler: ServerSampler) -> dict:
+    rss_before = sampler.rss_mb() if sampler else 0.0
+    connected, finished = _Phase(config["concurrency"]), _Phase(config["concurrency"])
+    tasks = [asyncio.create_task(_run_session(i, url, config, connected, finished))
+             for i in range(config["concurrency"])]
+    await connected.all_arrived.wait()
+    # 所有会话都已连上并完成首次渲染，从这里开始计时
+    cpu_before = sampler.cpu_s() if sampler else 0.0
+    client_before = time.process_time()
+    if sampler:
+        sampler.start()
+    wall_start = time.perf_counter()
+    connected.release.set()
+    await finished.all_arrived.wait()
+    wall = time.perf_counter() - wall_start
+    row = {"wall_s": wall, "client_cpu_s": time.process_time() - client_before}
+    if sampler:
+        sampler.stop()
+        row.update(server_cpu_s=sampler.cpu_s() - cpu_before, rss_before_mb=rss_before,
+                   rss_after_mb=sampler.rss_mb(), rss_peak_mb=sampler.peak_rss)
+    finished.release.set()
+    row["reports"] = await asyncio.gather(*tasks)
+    return row
+
+
+def run_level(url: str, concurrency: int, config: dict, sampler: ServerSampler = None) -> dict:
+    raw = asyncio.run(_run_level_async(url, dict(config, concurrency=concurrency), sampler))
+    reports, wall = raw["reports"], raw["wall_s"]
+    results = [r for rep in reports for r in rep["results"]]
+    errors = [rep["error"] for rep in reports if rep["error"]]
+    errors += sorted({p for r in results for p in r["problems"]})
+    latencies = [r["latency"] for r in results]
+    cpu = raw.get("server_cpu_s", 0.0)
+    return {
+        "concurrency": concurrency,
+        "turns": len(results),
+        "failed_turns": sum(not r["ok"] for r in results),
+        "script_runs": sum(rep["runs"] for rep in reports),
+        "errors": errors,
+        "throughput_tps": len(results) / wall if wall else 0.0,
+        "latency_p50_s": _percentile(latencies, 0.50),
+        "latency_p90_s": _percentile(latencies, 0.90),
+        "latency_p99_s": _percentile(latencies, 0.99),
+        "latency_mean_s": statistics.mean(latencies) if latencies else 0.0,
+        "server_cpu_percent": 100.0 * cpu / wall if wall else 0.0,
+        "server_cpu_ms_per_turn": 1000.0 * cpu / len(results) if results else 0.0,
+        "client_cpu_percent": 100.0 * raw["client_cpu_s"] / wall if wall else 0.0,
+        "server_rss_mb": raw.get("rss_after_mb", 0.0),
+        "server_rss_peak_mb": raw.get("rss_peak_mb", 0.0),
+        "server_rss_mb_per_session": (raw.get("rss_after_mb", 0.0) - raw.get("rss_before_mb", 0.0)) / concurrency,
+        "by_action": {
+            action: _percentile([r["latency"] for r in results if r["action"] == action], 0.50)
+            for action in sorted({r["action"] for r in results})
+        },
+    }
+
+
+def _parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action '{name}'")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def _start_mock(args) -> tuple:
+    port = _free_port()
+    cmd = [sys.executable, os.path.join(os.path.dirname(APP_PATH), "mock_llm.py"), "--port", str(port),
+           "--ttft", str(args.ttft), "--token-delay", str(args.token_delay), "--tokens", str(args.tokens)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}/v1"
+    _wait_http(f"{url}/models", 30, proc)
+    return proc, url
+
+
+def _start_server(llm_url: str, log_path: str) -> tuple:
+    port = _free_port()
+    env = dict(os.environ)
+    env["OPENAI_API_BASE"] = llm_url
+    env["VISION_BASE_URL"] = llm_url
+    env.setdefault("OPENAI_API_KEY", "sk-mock")
+    env.setdefault("VISION_API_KEY", env["OPENAI_API_KEY"])
+    cmd = [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true",
+           "--server.port", str(port), "--server.address", "127.0.0.1",
+           "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"]
+    log = open(log_path, "w", encoding="utf-8") if log_path else subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    _wait_http(f"{url}/_stcore/health", 60, proc)
+    return proc, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app_multi_agent.py.")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Concurrency ramp")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session at each level")
+    parser.add_argument("--mix", type=_parse_mix, default=DEFAULT_MIX,
+                        help="Action weights, e.g. text=0.6,persona=0.2,sketch=0.1,photo=0.1")
+    parser.add_argument("--url", help="Load an already running Streamlit server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="PID of the server given by --url, for CPU/RSS sampling")
+    parser.add_argument("--server-log", help="Write the started server's stdout/stderr to this file")
+    parser.add_argument("--base-url", help="Use an already running OpenAI-compatible endpoint instead of the mock")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Mock: seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Mock: seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=60, help="Mock: completion length")
+    parser.add_argument("--rag", action="store_true", help="Turn off Dev Mode so turns go through the real retriever")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for one script run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the full report to this file")
+    args = parser.parse_args()
+
+    if psutil is None and (not args.url or args.server_pid):
+        raise SystemExit("load_test.py samples the server process with psutil: pip install psutil")
+
+    procs = []
+    try:
+        if args.url:
+            url, pid = args.url, args.server_pid
+        else:
+            if args.base_url:
+                llm_url = args.base_url
+            else:
+                mock, llm_url = _start_mock(args)
+                procs.append(mock)
+            server, url = _start_server(llm_url, args.server_log)
+            procs.append(server)
+            pid = server.pid
+        sampler = ServerSampler(pid) if pid else None
+
+        config = {
+            "turns": args.turns, "mix": args.mix, "timeout": args.timeout, "rag": args.rag, "seed": args.seed,
+            "images": {"sketch": _sketch_png(), "photo": _photo_jpeg()},
+        }
+        # 预热：每种动作各跑一次，首次导入、头像生成和缓存构建不计入任何一级
+        warm = run_level(url, 1, dict(config, actions=list(args.mix)))
+        if warm["errors"]:
+            raise SystemExit(f"Warm-up session failed: {warm['errors'][0]}")
+
+        print(f"Server {url} (pid {pid or 'unknown'}) · mix {args.mix} · {args.turns} turns/session")
+        print(f"{'conc':>4} {'turns':>6} {'fail':>5} {'tps':>6} {'p50':>6} {'p90':>6} {'p99':>6} "
+              f"{'srv cpu%':>9} {'cpu_ms/turn':>12} {'rss MB':>7} {'+MB/sess':>9} {'client cpu%':>12}")
+        report = []
+        for level in args.levels:
+            row = run_level(url, level, config, sampler)
+            report.append(row)
+            print(f"{row['concurrency']:>4} {row['turns']:>6} {row['failed_turns']:>5} "
+                  f"{row['throughput_tps']:>6.2f} {row['latency_p50_s']:>6.2f} {row['latency_p90_s']:>6.2f} "
+                  f"{row['latency_p99_s']:>6.2f} {row['server_cpu_percent']:>9.0f} "
+                  f"{row['server_cpu_ms_per_turn']:>12.1f} {row['server_rss_mb']:>7.0f} "
+                  f"{row['server_rss_mb_per_session']:>9.1f} {row['client_cpu_percent']:>12.0f}")
+            for err in row["errors"][:3]:
+                print(f"     error: {err}")
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
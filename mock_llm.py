@@ -0,0 +1,205 @@
+"""本地 OpenAI 兼容模拟端点，用于压测和批处理，不消耗真实额度。
+
+支持：
+    POST /v1/chat/completions   （stream 与非 stream；stream_options.include_usage）
+    POST /v1/embeddings
+    GET  /v1/models
+
+用法：
+    python mock_llm.py --port 8001 --ttft 0.4 --token-delay 0.02 --tokens 80
+    OPENAI_API_BASE=http://127.0.0.1:8001/v1 VISION_BASE_URL=http://127.0.0.1:8001/v1 streamlit run app_multi_agent.py
+
+也可以在进程内启动：server = start_mock_server(port=0, ttft=0.2)，结束时 server.shutdown()。
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 回复里故意带上括号旁白和 *动作*，便于观察输出清洗
+_REPLY_WORDS = ["根据", "您的", "描述", "（温和地）", "我们", "可以", "*点头*", "慢慢", "来", "。",
+                "照护", "是", "一段", "漫长", "的", "旅程", "，", "请", "记得", "休息", "。"]
+
+EMBEDDING_DIM = 256
+
+
+class MockSettings:
+    def __init__(self, ttft: float = 0.3, token_delay: float = 0.02, tokens: int = 60,
+                 jitter: float = 0.1, error_rate: float = 0.0):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+
+def _approx_prompt_tokens(messages) -> int:
+    total = 0
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if p.get("type") == "text")
+        total += len(content or "") // 2 + 4
+    return total
+
+
+def _sleep(seconds: float, jitter: float):
+    if seconds > 0:
+        time.sleep(seconds * random.uniform(1 - jitter, 1 + jitter))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = MockSettings()
+    # 模拟前缀缓存：记住见过的 system prompt
+    _seen_prefixes = set()
+    _lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "mock-chat", "object": "model"}]})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if random.random() < self.settings.error_rate:
+            self._json(429, {"error": {"message": "mock rate limit", "type": "rate_limit_error"}})
+            return
+        if self.path.endswith("/chat/completions"):
+            self._chat(body)
+        elif self.path.endswith("/embeddings"):
+            self._embeddings(body)
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def _usage(self, messages, completion_tokens: int) -> dict:
+        prompt = _approx_prompt_tokens(messages)
+        system = messages[0].get("content", "") if messages else ""
+        with self._lock:
+            hit = system in self._seen_prefixes
+            self._seen_prefixes.add(system)
+        cached = min(prompt, _approx_prompt_tokens(messages[:1])) if hit else 0
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt + completion_tokens,
+            "prompt_cache_hit_tokens": cached,
+            "prompt_cache_miss_tokens": prompt - cached,
+        }
+
+    def _chat(self, body: dict):
+        s = self.settings
+        messages = body.get("messages", [])
+        model = body.get("model", "mock-chat")
+        n = min(s.tokens, body.get("max_tokens") or s.tokens)
+        words = [_REPLY_WORDS[i % len(_REPLY_WORDS)] for i in range(n)]
+        created = int(time.time())
+        rid = "chatcmpl-mock-" + hashlib.sha1(f"{created}{random.random()}".encode()).hexdigest()[:12]
+
+        if not body.get("stream"):
+            _sleep(s.ttft + s.token_delay * n, s.jitter)
+            self._json(200, {
+                "id": rid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": self._usage(messages, n),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send(payload):
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        base = {"id": rid, "object": "chat.completion.chunk", "created": created, "model": model}
+        try:
+            _sleep(s.ttft, s.jitter)
+            send({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+            for w in words:
+                send({**base, "choices": [{"index": 0, "delta": {"content": w}, "finish_reason": None}]})
+                _sleep(s.token_delay, s.jitter)
+            send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (body.get("stream_options") or {}).get("include_usage"):
+                send({**base, "choices": [], "usage": self._usage(messages, n)})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _embeddings(self, body: dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        _sleep(self.settings.ttft / 2, self.settings.jitter)
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int(hashlib.sha1(str(text).encode("utf-8")).hexdigest()[:8], 16)
+            rng = random.Random(seed)
+            data.append({"object": "embedding", "index": i,
+                         "embedding": [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]})
+        tokens = sum(len(str(t)) // 2 for t in inputs)
+        self._json(200, {"object": "list", "data": data, "model": body.get("model", "mock-embedding"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, **settings) -> ThreadingHTTPServer:
+    """在后台线程启动模拟端点；port=0 时自动分配，实际地址见 server.server_address。"""
+    handler = type("MockHandler", (_Handler,), {"settings": MockSettings(**settings), "_seen_prefixes": set()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=60, help="Completion length in tokens")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relative latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server = start_mock_server(args.host, args.port, ttft=args.ttft, token_delay=args.token_delay,
+                               tokens=args.tokens, jitter=args.jitter, error_rate=args.error_rate)
+    print(f"Mock LLM listening on {base_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
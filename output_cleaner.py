@@ -0,0 +1,119 @@
+"""流式输出清洗：去掉括号旁白、方括号和 *动作* 标记。
+
+与原先在完整回答上依次执行的三条正则完全等价：
+
+    re.sub(r'[（(].*?[)）]', '', ans)
+    re.sub(r'\\[.*?\\]', '', ans)
+    re.sub(r'\\*.*?\\*', '', ans)
+    ans.strip()
+
+但可以逐块喂入流式 token：每一级只扣住从未闭合的开符号起的那一小段，
+其余文本立即放出；已放出的文本不会被回头扫描。
+"""
+import re
+from typing import Iterable, Iterator
+
+
+class _SpanStripper:
+    """一条 `<开符号>.*?<闭符号>` 正则的增量版本（`.` 不匹配换行）。"""
+
+    __slots__ = ("_open_re", "_close_re", "_pending")
+
+    def __init__(self, openers: str, closers: str):
+        self._open_re = re.compile("[" + re.escape(openers) + "]")
+        self._close_re = re.compile("[" + re.escape(closers) + "\n]")
+        self._pending = ""  # 从未闭合的开符号起扣住的文本
+
+    def feed(self, text: str) -> str:
+        out = []
+        pos, n = 0, len(text)
+        while pos < n:
+            if self._pending:
+                m = self._close_re.search(text, pos)
+                if m is None:
+                    self._pending += text[pos:]
+                    break
+                end = m.end()
+                if m.group() == "\n":
+                    # 本行再无闭符号：开符号按原样保留，且扣住的段内不可能再有匹配
+                    out.append(self._pending)
+                    out.append(text[pos:end])
+                self._pending = ""
+                pos = end
+            else:
+                m = self._open_re.search(text, pos)
+                if m is None:
+                    out.append(text[pos:])
+                    break
+                out.append(text[pos:m.start()])
+                self._pending = m.group()
+                pos = m.end()
+        return "".join(out)
+
+    def flush(self) -> str:
+        rest, self._pending = self._pending, ""
+        return rest
+
+
+class StreamCleaner:
+    """有状态的清洗器：feed() 喂入文本块，返回已可确定的干净文本；结束时调用 flush()。"""
+
+    __slots__ = ("_stages", "_strip", "_started", "_trailing_ws")
+
+    def __init__(self, strip: bool = True):
+        self._stages = (
+            _SpanStripper("（(", ")）"),
+            _SpanStripper("[", "]"),
+            _SpanStripper("*", "*"),
+        )
+        self._strip = strip
+        self._started = False
+        self._trailing_ws = ""  # strip() 需要：末尾空白要等到后面出现非空白字符才放出
+
+    def _emit(self, text: str) -> str:
+        if not self._strip or not text:
+            return text
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        body = text.rstrip()
+        if not body:
+            self._trailing_ws += text
+            return ""
+        out = self._trailing_ws + body
+        self._trailing_ws = text[len(body):]
+        return out
+
+    def feed(self, chunk: str) -> str:
+        for stage in self._stages:
+            chunk = stage.feed(chunk)
+            if not chunk:
+                return ""
+        return self._emit(chunk)
+
+    def flush(self) -> str:
+        """流结束：放出所有仍未闭合的段（它们不会再被匹配），丢弃末尾空白。"""
+        text = ""
+        for stage in self._stages:
+            text = stage.feed(text) + stage.flush()
+        out = self._emit(text)
+        self._trailing_ws = "" if self._strip else self._trailing_ws
+        return out
+
+    def stream(self, chunks: Iterable[str]) -> Iterator[str]:
+        """包装一个文本块迭代器，逐块产出干净文本。"""
+        for chunk in chunks:
+            out = self.feed(chunk)
+            if out:
+                yield out
+        out = self.flush()
+        if out:
+            yield out
+
+
+def clean_output(text: str) -> str:
+    """一次性清洗完整回答。"""
+    cleaner = StreamCleaner()
+    return cleaner.feed(text) + cleaner.flush()
@@ -0,0 +1,95 @@
+"""对话请求的组装，按上游前缀缓存（context caching）友好的顺序排列。
+
+稳定部分在前：人设 system prompt + 历史轮次，每轮只在末尾追加，前缀逐字不变；
+易变部分在后：本轮检索到的参考文档和角色提醒只附在最后一条用户消息的末尾。
+历史窗口按块滑动，而不是每轮丢掉最早一条，这样窗口内的前缀也能连续多轮命中缓存；
+实际带上的历史在 HISTORY_WINDOW 到 HISTORY_WINDOW + HISTORY_TRIM_STEP - 1 条之间。
+"""
+from typing import List, Tuple
+
+# 至少带入的历史消息数
+HISTORY_WINDOW = 10
+# 窗口起点每次前移的消息数（偶数，保持 user/assistant 成对）
+HISTORY_TRIM_STEP = 6
+
+
+def history_window_start(history: List[dict], window: int = HISTORY_WINDOW, step: int = HISTORY_TRIM_STEP) -> int:
+    """历史窗口起点。
+
+    取不超过 n - window 的最大 step 整数倍，因此至少带上 window 条消息，
+    且起点只在跨过 step 的整数倍时移动，相邻几轮的前缀相同。
+    失败的轮次会留下连续的 user 消息，所以再向前退到最近的一条 user 消息。
+    """
+    overflow = max(0, len(history) - window)
+    start = overflow // step * step
+    while start > 0 and history[start]["role"] != "user":
+        start -= 1
+    return start
+
+
+def role_reminder(persona: dict) -> str:
+    return f"[提醒：你是 {persona['short_name']}，用你的独特风格回答]"
+
+
+def _user_content(msg: dict, tail: str = ""):
+    text = msg["content"] + tail
+    if "image" in msg:
+        return [
+            {"type": "text", "text": text},
+            {"type": "image_url", "image_url": {"url": msg["image"]}},
+        ]
+    return text
+
+
+def build_messages(persona: dict, history: List[dict], context: str = "") -> Tuple[List[dict], bool]:
+    """返回 (messages, has_images)。history 为会话中的消息，最后一条应为本轮用户输入。"""
+    window = history[history_window_start(history):]
+    messages = [{"role": "system", "content": persona["prompt"]}]
+    has_images = False
+
+    for i, m in enumerate(window):
+        if m["role"] != "user":
+            messages.append({"role": m["role"], "content": m["content"]})
+            continue
+        has_images = has_images or "image" in m
+        tail = ""
+        if i == len(window) - 1:
+            if context:
+                tail += f"\n\n### 参考文档：\n{context}"
+            tail += f"\n\n{role_reminder(persona)}"
+        messages.append({"role": "user", "content": _user_content(m, tail)})
+
+    return messages, has_images
+
+
+def _field(obj, name):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_summary(usage) -> dict:
+    """从上游 usage 中取出缓存命中情况。
+
+    DeepSeek 返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens；
+    OpenAI 兼容端点返回 prompt_tokens_details.cached_tokens。
+    """
+    if usage is None:
+        return {}
+    prompt = _field(usage, "prompt_tokens") or 0
+    cached = _field(usage, "prompt_cache_hit_tokens")
+    if cached is None:
+        cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    cached = cached or 0
+    uncached = _field(usage, "prompt_cache_miss_tokens")
+    if uncached is None:
+        uncached = max(0, prompt - cached)
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": _field(usage, "completion_tokens") or 0,
+        "total_tokens": _field(usage, "total_tokens") or 0,
+        "cached_prompt_tokens": cached,
+        "uncached_prompt_tokens": uncached,
+    }
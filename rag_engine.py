@@ -2,11 +2,18 @@ import os
 import streamlit as st
 from dotenv import load_dotenv
 import glob
+import fnmatch
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
 
 # 加载 .env 文件
 load_dotenv()
 from typing import List, Any, Union
 import openai
+from rate_limiter import ENDPOINT_DEEPSEEK, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, get_scheduler
 
 # LangChain compatibility imports
 HAS_LANGCHAIN = True
@@ -70,26 +77,111 @@ for _name in ('FAISS', 'CHROMA', 'Document', 'OpenAIEmbeddings', 'init_embedding
         globals()[_name] = None
 
 # --- 配置 ---
-DEEPSEEK_API_BASE = "https://api.deepseek.com/v1"
+DEEPSEEK_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.deepseek.com/v1")
 DEEPSEEK_EMBEDDING_MODEL = "deepseek-text" 
+# 建索引时每批嵌入的文本数；每批单独排队，避免一次占满上游额度
+EMBEDDING_BATCH_SIZE = 64
+# 后台嵌入在调度队列中的最长等待（秒）
+EMBEDDING_QUEUE_TIMEOUT = float(os.getenv("EMBEDDING_QUEUE_TIMEOUT", "600"))
 # Default directory for "Backend" knowledge base
 BACKEND_KB_DIR = "data"
+# 检索参数配置文件（由 tune_retrieval.py 写入，启动时读取）
+RAG_CONFIG_PATH = os.getenv("RAG_CONFIG_PATH", "rag_config.json")
+RAG_DEFAULTS = {"chunk_size": 1000, "chunk_overlap": 200, "k": 3}
+
+# --- 辅助函数：读取检索配置 ---
+def load_rag_config(path: str = None) -> dict:
+    """读取检索配置；文件缺失或字段无效时回退到默认值。"""
+    config = dict(RAG_DEFAULTS)
+    path = path or RAG_CONFIG_PATH
+    if not os.path.exists(path):
+        return config
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"[rag_engine] Ignoring unreadable {path}: {e}")
+        return config
+    for key in RAG_DEFAULTS:
+        value = data.get(key)
+        if isinstance(value, int) and value >= 0:
+            config[key] = value
+    if config["chunk_size"] <= 0 or config["k"] <= 0 or config["chunk_overlap"] >= config["chunk_size"]:
+        print(f"[rag_engine] Invalid values in {path}, using defaults.")
+        return dict(RAG_DEFAULTS)
+    return config
+
+RAG_CONFIG = load_rag_config()
+
+# 知识库分区配置：来源文件/文件夹 → 集合，人设 → 集合
+# 默认只搜索人设集合的子索引，命中不足 min_hits 时才检索全局索引补足。
+# 子索引命中的相关性门槛（距离越小越相关，超过门槛的不算命中），默认都关闭：
+#   max_distance    —— 绝对距离上限，依赖嵌入模型，用 `python tune_retrieval.py --calibrate-distance` 标定；
+#   relative_margin —— 可选：每次先做一次全局检索，距离超过全局最优 × (1 + margin) 的不算命中。
+#                      多一次全量检索，且其它集合更相近时会把人设自己的结果换成全局结果。
+RAG_COLLECTIONS_PATH = os.getenv("RAG_COLLECTIONS_PATH", "rag_collections.json")
+COLLECTION_DEFAULTS = {"sources": {}, "personas": {}, "min_hits": 2, "max_distance": None, "relative_margin": None}
+
+def load_collections_config(path: str = None) -> dict:
+    """读取分区配置；缺失时不分区，所有人设都检索全局索引。"""
+    config = dict(COLLECTION_DEFAULTS)
+    path = path or RAG_COLLECTIONS_PATH
+    if not os.path.exists(path):
+        return config
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"[rag_engine] Ignoring unreadable {path}: {e}")
+        return config
+    for key in COLLECTION_DEFAULTS:
+        if key in data:
+            config[key] = data[key]
+    return config
+
+RAG_COLLECTIONS = load_collections_config()
+
+def collections_for_source(source: str) -> List[str]:
+    """按配置中的通配符（相对 data/ 的路径或文件名）给来源文件打集合标签。"""
+    rel = os.path.relpath(source, BACKEND_KB_DIR).replace(os.sep, "/")
+    name = os.path.basename(source)
+    tags = []
+    for pattern, collections in RAG_COLLECTIONS["sources"].items():
+        if fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(name, pattern):
+            for c in ([collections] if isinstance(collections, str) else collections):
+                if c not in tags:
+                    tags.append(c)
+    return tags
+
+def persona_collections(short_name: str) -> List[str]:
+    """人设对应的集合；未配置时返回空列表（检索全局）。"""
+    return list(RAG_COLLECTIONS["personas"].get(short_name, []))
+
+# --- 辅助函数：估算 token 数 ---
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 DeepSeek token 数：中文字符约 0.6 token，其他字符约 0.3 token。"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
 
 # --- 辅助函数：扫面文件夹中的 PDF ---
 def get_backend_pdfs() -> List[str]:
-    """获取 data 文件夹下所有的 PDF 文件路径。"""
+    """获取 data 文件夹（含子文件夹）下所有的 PDF 文件路径。"""
     if not os.path.exists(BACKEND_KB_DIR):
         return []
-    pattern = os.path.join(BACKEND_KB_DIR, "*.pdf")
-    return glob.glob(pattern)
+    pattern = os.path.join(BACKEND_KB_DIR, "**", "*.pdf")
+    return glob.glob(pattern, recursive=True)
 
-# --- 辅助函数：加载和分割文档 ---
-@st.cache_data(show_spinner="Loading documents from PDFs and splitting text...")
-def load_and_split_documents(file_paths: List[str]) -> List["Document"]:
-    """加载一个或多个 PDF 文档并递归地分割成小块。"""
+# --- 辅助函数：加载文档（提取结果缓存，调参时不重复解析 PDF）---
+@st.cache_data(show_spinner="Loading documents from PDFs...")
+def load_documents(file_paths: List[str]) -> List["Document"]:
+    """加载一个或多个 PDF 文档，按页返回。"""
     if not file_paths:
         return []
-        
+
     all_documents = []
     for file_path in file_paths:
         try:
@@ -120,78 +212,269 @@ def load_and_split_documents(file_paths: List[str]) -> List["Document"]:
             all_documents.extend(documents)
         except Exception as e:
             st.error(f"Failed to process {file_path}: {e}")
+    return all_documents
 
-    if not all_documents:
-        return []
+# --- 辅助函数：分割文档 ---
+def split_documents(documents: List["Document"], chunk_size: int = None, chunk_overlap: int = None) -> List["Document"]:
+    """把页级文档递归地分割成小块。"""
+    chunk_size = chunk_size or RAG_CONFIG["chunk_size"]
+    chunk_overlap = RAG_CONFIG["chunk_overlap"] if chunk_overlap is None else chunk_overlap
 
     # st.write(f"Total pages loaded: {len(all_documents)}. Splitting...") # Silence logs
     if 'RecursiveCharacterTextSplitter' in globals() and RecursiveCharacterTextSplitter is not None:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(all_documents)
-    else:
-        splits = []
-        for doc in all_documents:
-            text = getattr(doc, 'page_content', '')
-            for i in range(0, len(text), 800):
-                chunk = text[i:i+1000]
-                meta = getattr(doc, 'metadata', {}).copy()
-                if 'Document' in globals() and Document is not None:
-                    splits.append(Document(page_content=chunk, metadata=meta))
-                else:
-                    from types import SimpleNamespace
-                    splits.append(SimpleNamespace(page_content=chunk, metadata=meta))
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return text_splitter.split_documents(documents)
+
+    splits = []
+    step = max(1, chunk_size - chunk_overlap)
+    for doc in documents:
+        text = getattr(doc, 'page_content', '')
+        for i in range(0, len(text), step):
+            chunk = text[i:i+chunk_size]
+            meta = getattr(doc, 'metadata', {}).copy()
+            if 'Document' in globals() and Document is not None:
+                splits.append(Document(page_content=chunk, metadata=meta))
+            else:
+                from types import SimpleNamespace
+                splits.append(SimpleNamespace(page_content=chunk, metadata=meta))
     return splits
 
+@st.cache_data(show_spinner="Splitting text...")
+def load_and_split_documents(file_paths: List[str], chunk_size: int = None, chunk_overlap: int = None) -> List["Document"]:
+    """加载一个或多个 PDF 文档并递归地分割成小块。"""
+    if not file_paths:
+        return []
+    all_documents = load_documents(file_paths)
+    if not all_documents:
+        return []
+    return split_documents(all_documents, chunk_size, chunk_overlap)
+
+def splits_digest(splits: List["Document"]) -> str:
+    """分块内容的指纹，用作向量库缓存键。"""
+    h = hashlib.sha1()
+    for d in splits:
+        h.update(getattr(d, 'page_content', '').encode("utf-8", "ignore"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+# --- 向量缓存：相同文本只嵌入一次，重建索引时复用 ---
+@st.cache_resource
+def _embedding_cache() -> dict:
+    return {}
+
+# 查询向量 LRU 的容量
+QUERY_CACHE_SIZE = 256
+
+class _LRUCache:
+    """线程安全的定长 LRU。"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+@st.cache_resource
+def _query_cache() -> _LRUCache:
+    return _LRUCache(QUERY_CACHE_SIZE)
+
+_EmbeddingsBase = object
+try:
+    from langchain_core.embeddings import Embeddings as _EmbeddingsBase
+except ImportError:
+    pass
+
+class CachedEmbeddings(_EmbeddingsBase):
+    """按 (模型, 文本) 缓存向量的 Embeddings 包装。"""
+
+    def __init__(self, inner, model_name: str = DEEPSEEK_EMBEDDING_MODEL):
+        self.inner = inner
+        self.model_name = model_name
+        self.cache = _embedding_cache()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8", "ignore")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.cache and key not in missing:
+                missing[key] = text
+        pending = list(missing.items())
+        scheduler = get_scheduler()
+        for i in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+            batch = pending[i:i + EMBEDDING_BATCH_SIZE]
+            tokens = sum(estimate_tokens(t) for _, t in batch)
+            # 建索引是后台任务：让位给交互式聊天
+            with scheduler.acquire(ENDPOINT_DEEPSEEK, tokens, PRIORITY_BACKGROUND, EMBEDDING_QUEUE_TIMEOUT):
+                vectors = self.inner.embed_documents([t for _, t in batch])
+            self.cache.update(zip([k for k, _ in batch], vectors))
+        return [self.cache[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # 查询向量不进文档缓存（用户输入无穷多），只放进有上限的 LRU；
+        # 同一轮里各分区子索引会重复嵌入同一查询，靠它只请求一次
+        key = self._key(text)
+        cached = _query_cache().get(key)
+        if cached is None:
+            with get_scheduler().acquire(ENDPOINT_DEEPSEEK, estimate_tokens(text), PRIORITY_INTERACTIVE):
+                cached = self.inner.embed_query(text)
+            _query_cache().put(key, cached)
+        return cached
+
 @st.cache_resource(show_spinner="Initializing Vector Store...")
-def get_vector_store_and_retriever(_splits: List["Document"]) -> Union["VectorStoreRetriever", Any]:
+def build_vector_store(_splits: List["Document"], splits_key: str) -> Any:
+    """为一组分块建立 FAISS 索引；splits_key 标识分块内容。"""
+    DEEPSEEK_API_KEY = os.getenv("OPENAI_API_KEY")
+    embeddings = CachedEmbeddings(OpenAIEmbeddings(
+        model=DEEPSEEK_EMBEDDING_MODEL, 
+        openai_api_key=DEEPSEEK_API_KEY,
+        openai_api_base=DEEPSEEK_API_BASE
+    ))
+    return FAISS.from_documents(_splits, embeddings)
+
+def tag_collections(splits: List["Document"]) -> dict:
+    """给每个分块写入 metadata["collections"]，返回 集合 → 分块列表。"""
+    partitions = {}
+    tags_by_source = {}
+    for d in splits:
+        source = d.metadata.get("source", "")
+        if source not in tags_by_source:
+            tags_by_source[source] = collections_for_source(source)
+        d.metadata["collections"] = tags_by_source[source]
+        for c in tags_by_source[source]:
+            partitions.setdefault(c, []).append(d)
+    untagged = sorted(os.path.basename(s) for s, tags in tags_by_source.items() if not tags)
+    if untagged and RAG_COLLECTIONS["personas"]:
+        # 未归入任何集合的文件只能经由全局补足出现
+        print(f"[rag_engine] {len(untagged)} source(s) match no collection in {RAG_COLLECTIONS_PATH}: "
+              f"{', '.join(untagged)}")
+    return partitions
+
+class PartitionedRetriever:
+    """全局索引 + 按集合预过滤的子索引。
+
+    传入 collections 时只搜索这些集合的子索引；命中少于 min_hits 时用全局结果补足到 k。
+    search 函数签名为 (query, k) -> [(doc, distance)]，距离越小越相关。
+    距离超过 max_distance 的子索引结果不算命中。只有显式设置 relative_margin（且未设 max_distance）时
+    才先做一次全局检索，超过全局最优距离 × (1 + relative_margin) 的不算命中，补足时复用这次结果。
+    """
+
+    def __init__(self, global_search, partitions: dict, k: int, min_hits: int = 2, max_distance: float = None,
+                 relative_margin: float = None):
+        self.global_search = global_search
+        self.partitions = partitions
+        self.k = k
+        self.min_hits = min_hits
+        self.max_distance = max_distance
+        self.relative_margin = relative_margin
+
+    @staticmethod
+    def _doc_key(doc) -> tuple:
+        return (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+    def get_relevant_documents(self, query: str, collections: List[str] = None) -> List["Document"]:
+        searches = [self.partitions[c] for c in (collections or []) if c in self.partitions]
+        if not searches:
+            return [d for d, _ in self.global_search(query, self.k)]
+
+        global_results = None
+        cutoff = self.max_distance
+        if cutoff is None and self.relative_margin is not None:
+            global_results = self.global_search(query, self.k)
+            if global_results:
+                best = global_results[0][1]
+                cutoff = max(best * (1 + self.relative_margin), best + 1e-6)
+
+        scored = []
+        for search in searches:
+            scored.extend(search(query, self.k))
+        scored.sort(key=lambda pair: pair[1])
+
+        docs, seen = [], set()
+        for d, distance in scored:
+            key = self._doc_key(d)
+            if key in seen or (cutoff is not None and distance > cutoff):
+                continue
+            seen.add(key)
+            docs.append(d)
+            if len(docs) >= self.k:
+                break
+
+        if len(docs) < self.min_hits:
+            if global_results is None:
+                global_results = self.global_search(query, self.k)
+            for d, _ in global_results:
+                if len(docs) >= self.k:
+                    break
+                if self._doc_key(d) not in seen:
+                    seen.add(self._doc_key(d))
+                    docs.append(d)
+        return docs
+
+def _faiss_search(db):
+    return lambda query, k: db.similarity_search_with_score(query, k=k)
+
+def get_vector_store_and_retriever(_splits: List["Document"], splits_key: str = None, k: int = None) -> Union["VectorStoreRetriever", Any]:
     DEEPSEEK_API_KEY = os.getenv("OPENAI_API_KEY")
     is_dev = os.getenv("RAG_USE_RANDOM_EMBEDDINGS") == "1"
+    k = k or RAG_CONFIG["k"]
+    min_hits = RAG_COLLECTIONS["min_hits"]
+    max_distance = RAG_COLLECTIONS["max_distance"]
+    relative_margin = RAG_COLLECTIONS["relative_margin"]
     
     if not DEEPSEEK_API_KEY and not is_dev:
         st.error("OPENAI_API_KEY not set.")
         return None
 
     try:
-        embeddings = None
-        if not is_dev:
-            embeddings = OpenAIEmbeddings(
-                model=DEEPSEEK_EMBEDDING_MODEL, 
-                openai_api_key=DEEPSEEK_API_KEY,
-                openai_api_base=DEEPSEEK_API_BASE
-            )
+        partitions = tag_collections(_splits)
 
         if FAISS is not None and not is_dev:
-            db = FAISS.from_documents(_splits, embeddings)
-            return db.as_retriever(search_kwargs={"k": 3})
+            db = build_vector_store(_splits, splits_key or splits_digest(_splits))
+            # 子索引复用全局构建时缓存的向量，不再请求嵌入接口
+            sub_dbs = {name: build_vector_store(docs, splits_digest(docs)) for name, docs in partitions.items()}
+            return PartitionedRetriever(
+                _faiss_search(db), {name: _faiss_search(sub) for name, sub in sub_dbs.items()},
+                k, min_hits, max_distance, relative_margin)
 
         # Fallback to in-memory random retriever if dev mode or no FAISS
-        def _get_random_emb(texts):
-            import numpy as np
-            out = []
-            for t in texts:
-                seed = abs(hash(t)) % (2**32)
-                out.append(np.random.RandomState(seed).rand(1536).tolist())
-            return out
-
-        class SimpleRetriever:
-            def __init__(self, docs): self.docs = docs
-            def get_relevant_documents(self, query):
-                # Just return top 3 docs for dev mode
-                return self.docs[:3]
-
-        return SimpleRetriever(_splits)
+        def _first_k(docs):
+            # Just return top k docs for dev mode
+            return lambda query, n: [(d, 0.0) for d in docs[:n]]
+
+        return PartitionedRetriever(
+            _first_k(_splits), {name: _first_k(docs) for name, docs in partitions.items()},
+            k, min_hits, max_distance, relative_margin)
 
     except Exception as e:
         st.error(f"Init Error: {e}")
         return None
 
-def get_retriever(file_paths: List[str] = None) -> Any:
-    """主入口：如果没传路径，则尝试扫描 data 文件夹。"""
+def get_retriever(file_paths: List[str] = None, chunk_size: int = None, chunk_overlap: int = None, k: int = None) -> Any:
+    """主入口：如果没传路径，则尝试扫描 data 文件夹。分块与 k 默认取自 RAG_CONFIG。"""
     targets = file_paths if file_paths else get_backend_pdfs()
     if not targets:
         st.warning("No PDF files found in 'data/' folder.")
         return None
         
-    splits = load_and_split_documents(targets)
+    splits = load_and_split_documents(targets, chunk_size, chunk_overlap)
     if not splits: return None
-    return get_vector_store_and_retriever(splits)
+    return get_vector_store_and_retriever(splits, splits_digest(splits), k)
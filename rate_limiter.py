@@ -0,0 +1,245 @@
+"""进程级上游准入控制：每个端点一组令牌桶（请求/分钟、token/分钟）加有界优先级等待队列。
+
+所有 Streamlit 会话共享同一个 Scheduler（get_scheduler 用 st.cache_resource 缓存），
+交互式聊天优先于后台的向量构建：排队按优先级放行，队列满时交互请求会挤掉
+最晚进入的后台等待者（被挤掉的一方收到 QueueFullError）。用法：
+
+    with get_scheduler().acquire(ENDPOINT_DEEPSEEK, tokens=1200) as ticket:
+        res = client.chat.completions.create(...)
+        ticket.settle(res.usage.total_tokens)
+
+限额通过环境变量配置，默认 0（不限，与引入调度器之前一致）；请按所用服务商账号
+等级的实际配额设置。注意一轮文字聊天消耗 2 次 DeepSeek 请求（查询向量 + 补全）：
+    DEEPSEEK_RPM / DEEPSEEK_TPM, VISION_RPM / VISION_TPM,
+    RATE_LIMIT_QUEUE_SIZE（每端点最大排队数）, RATE_LIMIT_TIMEOUT（秒）
+    RATE_LIMIT_STATS_INTERVAL（秒，默认 60；每隔这么久向 stdout 打一行
+    "[rate_limiter] stats {...}" JSON，含排队深度与等待时间，0 表示关闭）
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+import streamlit as st
+
+ENDPOINT_DEEPSEEK = "deepseek"
+ENDPOINT_VISION = "vision"
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class AdmissionError(RuntimeError):
+    """请求未被放行到上游。"""
+
+
+class QueueFullError(AdmissionError):
+    pass
+
+
+class AdmissionTimeoutError(AdmissionError):
+    pass
+
+
+class TokenBucket:
+    """按分钟额度匀速补充的令牌桶；limit 为 0 时不限流。"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float):
+        if self.capacity:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """按实际用量修正预扣（delta > 0 表示多用了）。"""
+        if self.capacity:
+            self.level = min(self.capacity, self.level - delta)
+
+
+class Ticket:
+    """一次已放行的上游调用；作为上下文管理器统计在途请求数。"""
+
+    def __init__(self, limiter: "EndpointLimiter", tokens: int, waited: float):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.waited = waited
+        self._released = False
+
+    def settle(self, actual_tokens: int):
+        """用上游返回的真实 token 数修正预估。"""
+        if actual_tokens is None:
+            return
+        with self.limiter._cond:
+            self.limiter._tokens.adjust(actual_tokens - self.tokens)
+            self.tokens = actual_tokens
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        with self.limiter._cond:
+            self.limiter._in_flight -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class EndpointLimiter:
+    def __init__(self, name: str, rpm: int, tpm: int, max_queue: int = 64, timeout: float = 30.0):
+        self.name = name
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._waiters = []  # heap of (priority, seq)
+        self._evicted = set()
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._waits = deque(maxlen=500)
+
+    def acquire(self, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE, timeout: float = None) -> Ticket:
+        """排队直到额度足够；队列满抛 QueueFullError，超时抛 AdmissionTimeoutError。"""
+        timeout = self.timeout if timeout is None else timeout
+        with self._cond:
+            if len(self._waiters) >= self.max_queue:
+                # 队列满时，更高优先级的请求挤掉最晚进入的最低优先级等待者
+                victim = max(self._waiters)
+                if victim[0] <= priority:
+                    self._rejected += 1
+                    raise QueueFullError(f"{self.name}: {len(self._waiters)} requests already waiting")
+                self._waiters.remove(victim)
+                heapq.heapify(self._waiters)
+                self._evicted.add(victim)
+                self._cond.notify_all()
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            start = time.monotonic()
+            deadline = start + timeout
+            try:
+                while True:
+                    now = time.monotonic()
+                    if entry in self._evicted:
+                        self._evicted.discard(entry)
+                        self._rejected += 1
+                        raise QueueFullError(f"{self.name}: displaced by a higher-priority request")
+                    wait = None
+                    if self._waiters[0] == entry:
+                        wait = max(self._requests.time_until(1, now), self._tokens.time_until(tokens, now))
+                        if wait <= 0:
+                            break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise AdmissionTimeoutError(f"{self.name}: no capacity within {timeout:g}s")
+                    limit = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(None if limit == float("inf") else limit)
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._waiters)
+            self._requests.take(1, now)
+            self._tokens.take(tokens, now)
+            self._in_flight += 1
+            self._admitted += 1
+            waited = now - start
+            self._waits.append(waited)
+            self._cond.notify_all()
+            return Ticket(self, tokens, waited)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "queue_depth": len(self._waiters),
+                "in_flight": self._in_flight,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "wait_ms_p50": waits[len(waits) // 2] * 1000 if waits else 0.0,
+                "wait_ms_p95": waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0,
+                "wait_ms_max": waits[-1] * 1000 if waits else 0.0,
+            }
+
+
+class Scheduler:
+    def __init__(self, limiters: Dict[str, EndpointLimiter]):
+        self.limiters = limiters
+
+    def acquire(self, endpoint: str, tokens: int = 0, priority: int = PRIORITY_INTERACTIVE, timeout: float = None) -> Ticket:
+        return self.limiters[endpoint].acquire(tokens, priority, timeout)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+    def start_stats_logger(self, interval: float):
+        """后台线程每 interval 秒向 stdout 打一行 JSON 统计，供日志采集和告警。"""
+        def run():
+            while True:
+                time.sleep(interval)
+                print(f"[rate_limiter] stats {json.dumps(self.stats(), sort_keys=True)}", flush=True)
+
+        threading.Thread(target=run, name="rate-limiter-stats", daemon=True).start()
+
+
+def _env_number(name: str, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@st.cache_resource
+def get_scheduler() -> Scheduler:
+    """整个进程共享的调度器。"""
+    max_queue = _env_number("RATE_LIMIT_QUEUE_SIZE", 64)
+    timeout = _env_number("RATE_LIMIT_TIMEOUT", 30.0, float)
+    stats_interval = _env_number("RATE_LIMIT_STATS_INTERVAL", 60.0, float)
+    scheduler = Scheduler({
+        ENDPOINT_DEEPSEEK: EndpointLimiter(
+            ENDPOINT_DEEPSEEK,
+            rpm=_env_number("DEEPSEEK_RPM", 0),
+            tpm=_env_number("DEEPSEEK_TPM", 0),
+            max_queue=max_queue, timeout=timeout),
+        ENDPOINT_VISION: EndpointLimiter(
+            ENDPOINT_VISION,
+            rpm=_env_number("VISION_RPM", 0),
+            tpm=_env_number("VISION_TPM", 0),
+            max_queue=max_queue, timeout=timeout),
+    })
+    if stats_interval > 0:
+        scheduler.start_stats_logger(stats_interval)
+    return scheduler
@@ -0,0 +1,33 @@
+"""断点文件：修复写了一半的末行，以及按最后一行判断完成状态。"""
+import json
+
+from batch_runner import completed_ids, repair_checkpoint
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+
+
+def test_repair_truncates_partial_last_line(tmp_path):
+    out = tmp_path / "results.jsonl"
+    _write(out, json.dumps({"id": "1"}) + "\n" + '{"id": "2", "resp')
+    repair_checkpoint(str(out))
+    assert out.read_text(encoding="utf-8") == json.dumps({"id": "1"}) + "\n"
+
+
+def test_repair_keeps_complete_file_and_clears_single_partial_line(tmp_path):
+    out = tmp_path / "results.jsonl"
+    _write(out, '{"id": "1"}\n')
+    repair_checkpoint(str(out))
+    assert out.read_text(encoding="utf-8") == '{"id": "1"}\n'
+    _write(out, '{"id": "1", "resp')
+    repair_checkpoint(str(out))
+    assert out.read_text(encoding="utf-8") == ""
+    repair_checkpoint(str(tmp_path / "missing.jsonl"))
+
+
+def test_completed_ids_uses_last_row_per_id(tmp_path):
+    out = tmp_path / "results.jsonl"
+    rows = [{"id": "1", "error": "RateLimitError"}, {"id": "2"}, {"id": "1"}, {"id": "2", "error": "x"}]
+    _write(out, "".join(json.dumps(r) + "\n" for r in rows))
+    assert completed_ids(str(out)) == {"1"}
@@ -0,0 +1,73 @@
+"""StreamCleaner 与原先三条正则 + strip() 的等价性（随机性质测试）及每块耗时。"""
+import random
+import re
+import time
+
+from output_cleaner import StreamCleaner, clean_output
+
+ALPHABET = list("（()）[]*\n\t  ab中")
+
+
+def regex_clean(ans: str) -> str:
+    ans = re.sub(r'[（(].*?[)）]', '', ans)
+    ans = re.sub(r'\[.*?\]', '', ans)
+    ans = re.sub(r'\*.*?\*', '', ans)
+    return ans.strip()
+
+
+def random_text(rng: random.Random, max_len: int = 30) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_len)))
+
+
+def random_chunks(rng: random.Random, text: str):
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 6)
+        yield text[i:i + n]
+        i += n
+
+
+def test_whole_string_matches_regexes():
+    rng = random.Random(0)
+    for _ in range(50000):
+        text = random_text(rng)
+        assert clean_output(text) == regex_clean(text), repr(text)
+
+
+def test_random_chunking_matches_regexes():
+    rng = random.Random(1)
+    for _ in range(50000):
+        text = random_text(rng)
+        cleaner = StreamCleaner()
+        out = "".join(cleaner.feed(chunk) for chunk in random_chunks(rng, text)) + cleaner.flush()
+        assert out == regex_clean(text), repr(text)
+
+
+def test_stream_wrapper_and_empty_chunks():
+    text = "  （温和地）我理解*点头*你的[注]感受。\n(unclosed\n*a  "
+    cleaner = StreamCleaner()
+    chunks = ["", *text, ""]
+    assert "".join(cleaner.stream(chunks)) == regex_clean(text)
+
+
+def test_holds_back_only_unresolved_span():
+    cleaner = StreamCleaner()
+    assert cleaner.feed("你好（") == "你好"
+    assert cleaner.feed("轻声") == ""
+    assert cleaner.feed("）世界") == "世界"
+    assert cleaner.flush() == ""
+
+
+def test_per_chunk_cost_is_microseconds():
+    text = "根据您的描述（温和地），建议*点头*进行[注]全面体检。\n" * 200
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+    best = float("inf")
+    for _ in range(3):
+        cleaner = StreamCleaner()
+        start = time.perf_counter()
+        for chunk in chunks:
+            cleaner.feed(chunk)
+        cleaner.flush()
+        best = min(best, (time.perf_counter() - start) / len(chunks))
+    # 实测约 1µs/块；留足余量以免在慢机器上误报，但仍远低于毫秒级
+    assert best < 50e-6, f"{best * 1e6:.1f} us per chunk"
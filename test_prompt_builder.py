@@ -0,0 +1,53 @@
+"""build_messages：历史窗口大小、起点落在 user 消息、稳定前缀与易变尾部。"""
+from prompt_builder import HISTORY_TRIM_STEP, HISTORY_WINDOW, build_messages, history_window_start
+
+PERSONA = {"prompt": "P", "short_name": "X"}
+
+
+def _conversation(turns: int):
+    history = []
+    for t in range(turns):
+        history.append({"role": "user", "content": f"u{t}"})
+        history.append({"role": "assistant", "content": f"a{t}", "persona_name": "X"})
+    return history
+
+
+def test_window_keeps_at_least_history_window_messages():
+    history = []
+    for t in range(40):
+        history.append({"role": "user", "content": f"u{t}"})
+        start = history_window_start(history)
+        sent = len(history) - start
+        assert min(len(history), HISTORY_WINDOW) <= sent < HISTORY_WINDOW + HISTORY_TRIM_STEP
+        assert history[start]["role"] == "user"
+        history.append({"role": "assistant", "content": f"a{t}"})
+
+
+def test_window_starts_on_user_after_failed_turn():
+    # 失败的轮次留下两条连续的 user 消息，破坏了奇偶交替
+    history = [{"role": "user", "content": "lost"}] + _conversation(8) + [{"role": "user", "content": "now"}]
+    start = history_window_start(history)
+    assert history[start]["role"] == "user"
+    assert len(history) - start >= HISTORY_WINDOW
+
+
+def test_prefix_is_stable_and_volatile_parts_come_last():
+    history = _conversation(3) + [{"role": "user", "content": "u3"}]
+    messages, has_images = build_messages(PERSONA, history, "ctx")
+    assert not has_images
+    assert messages[0] == {"role": "system", "content": "P"}
+    assert messages[1] == {"role": "user", "content": "u0"}
+    assert messages[2] == {"role": "assistant", "content": "a0"}
+    assert messages[-1]["content"].startswith("u3\n\n### 参考文档：\nctx")
+    assert messages[-1]["content"].endswith("[提醒：你是 X，用你的独特风格回答]")
+
+    history += [{"role": "assistant", "content": "a3"}, {"role": "user", "content": "u4"}]
+    following, _ = build_messages(PERSONA, history, "other")
+    assert following[:-3] == messages[:-1]
+
+
+def test_image_message_becomes_content_parts():
+    history = [{"role": "user", "content": "look", "image": "data:image/png;base64,AA"}]
+    messages, has_images = build_messages(PERSONA, history)
+    assert has_images
+    assert messages[-1]["content"][1] == {"type": "image_url", "image_url": {"url": "data:image/png;base64,AA"}}
@@ -0,0 +1,74 @@
+"""PartitionedRetriever：子索引命中的距离门槛与全局补足；data/ 中每个 PDF 都归入了集合。"""
+from types import SimpleNamespace
+
+from rag_engine import PartitionedRetriever, collections_for_source, get_backend_pdfs
+
+
+def _search(pairs):
+    docs = [(SimpleNamespace(page_content=text, metadata={"source": text}), distance) for text, distance in pairs]
+    calls = []
+
+    def search(query, k):
+        calls.append(query)
+        return docs[:k]
+    search.calls = calls
+    return search
+
+
+GLOBAL = [("g1", 0.20), ("g2", 0.25), ("g3", 0.30)]
+
+
+def _sources(docs):
+    return [d.metadata["source"] for d in docs]
+
+
+def test_relative_margin_falls_back_when_partition_hits_are_far():
+    global_search = _search(GLOBAL)
+    partition = _search([("p1", 0.22), ("p2", 0.60), ("p3", 0.70)])
+    retriever = PartitionedRetriever(global_search, {"clinical": partition}, k=3, min_hits=2,
+                                     relative_margin=0.15)
+    # 只有 p1 在 0.20 × 1.15 以内，少于 min_hits，用同一次全局结果补足
+    assert _sources(retriever.get_relevant_documents("q", ["clinical"])) == ["p1", "g1", "g2"]
+    assert len(global_search.calls) == 1
+
+
+def test_relative_margin_keeps_close_partition_hits():
+    global_search = _search(GLOBAL)
+    partition = _search([("p1", 0.20), ("p2", 0.21), ("p3", 0.50)])
+    retriever = PartitionedRetriever(global_search, {"clinical": partition}, k=3, min_hits=2,
+                                     relative_margin=0.15)
+    assert _sources(retriever.get_relevant_documents("q", ["clinical"])) == ["p1", "p2"]
+
+
+def test_absolute_max_distance_overrides_relative_margin():
+    global_search = _search(GLOBAL)
+    partition = _search([("p1", 0.40), ("p2", 0.45), ("p3", 0.90)])
+    retriever = PartitionedRetriever(global_search, {"clinical": partition}, k=3, min_hits=2,
+                                     max_distance=0.5, relative_margin=0.15)
+    assert _sources(retriever.get_relevant_documents("q", ["clinical"])) == ["p1", "p2"]
+    assert global_search.calls == []
+
+
+def test_without_collections_uses_global_index():
+    retriever = PartitionedRetriever(_search(GLOBAL), {"clinical": _search([("p1", 0.1)])}, k=2)
+    assert _sources(retriever.get_relevant_documents("q")) == ["g1", "g2"]
+
+
+def test_default_searches_partitions_only_when_hits_suffice():
+    global_search = _search(GLOBAL)
+    partition = _search([("p1", 0.60), ("p2", 0.70), ("p3", 0.80)])
+    retriever = PartitionedRetriever(global_search, {"clinical": partition}, k=3, min_hits=2)
+    assert _sources(retriever.get_relevant_documents("q", ["clinical"])) == ["p1", "p2", "p3"]
+    assert global_search.calls == []
+
+
+def test_default_tops_up_from_global_when_partition_is_short():
+    global_search = _search(GLOBAL)
+    retriever = PartitionedRetriever(global_search, {"clinical": _search([("p1", 0.6)])}, k=3, min_hits=2)
+    assert _sources(retriever.get_relevant_documents("q", ["clinical"])) == ["p1", "g1", "g2"]
+    assert len(global_search.calls) == 1
+
+
+def test_every_bundled_pdf_is_tagged():
+    untagged = [p for p in get_backend_pdfs() if not collections_for_source(p)]
+    assert untagged == []
@@ -0,0 +1,61 @@
+"""EndpointLimiter：优先级放行、队列满时交互请求挤掉后台等待者、超时。"""
+import threading
+import time
+
+import pytest
+
+from rate_limiter import (AdmissionTimeoutError, EndpointLimiter, PRIORITY_BACKGROUND,
+                          PRIORITY_INTERACTIVE, QueueFullError)
+
+
+def _drain(limiter: EndpointLimiter, n: int):
+    for _ in range(n):
+        limiter.acquire().release()
+
+
+def _start_waiter(limiter, priority, outcomes, tag, timeout=5.0):
+    def run():
+        try:
+            with limiter.acquire(priority=priority, timeout=timeout):
+                outcomes.append(tag)
+        except QueueFullError:
+            outcomes.append(f"{tag}:full")
+        except AdmissionTimeoutError:
+            outcomes.append(f"{tag}:timeout")
+
+    t = threading.Thread(target=run)
+    t.start()
+    time.sleep(0.05)
+    return t
+
+
+def test_interactive_evicts_background_when_queue_full():
+    limiter = EndpointLimiter("t", rpm=60, tpm=0, max_queue=2)
+    _drain(limiter, 60)  # 桶空，之后每秒放行一个
+    outcomes = []
+    threads = [_start_waiter(limiter, PRIORITY_BACKGROUND, outcomes, f"bg{i}") for i in range(2)]
+    threads.append(_start_waiter(limiter, PRIORITY_INTERACTIVE, outcomes, "chat"))
+    for t in threads:
+        t.join()
+    assert "bg1:full" in outcomes  # 最晚进入的后台请求被挤掉
+    assert outcomes.index("chat") < outcomes.index("bg0")
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_background_cannot_evict_when_queue_full():
+    limiter = EndpointLimiter("t", rpm=600, tpm=0, max_queue=1)
+    _drain(limiter, 600)
+    outcomes = []
+    first = _start_waiter(limiter, PRIORITY_INTERACTIVE, outcomes, "chat")
+    with pytest.raises(QueueFullError):
+        limiter.acquire(priority=PRIORITY_BACKGROUND)
+    first.join()
+    assert outcomes == ["chat"]
+
+
+def test_timeout_message_keeps_subsecond_precision():
+    limiter = EndpointLimiter("t", rpm=1, tpm=0)
+    _drain(limiter, 1)
+    with pytest.raises(AdmissionTimeoutError, match="0.2s"):
+        limiter.acquire(timeout=0.2)
+    assert limiter.stats()["queue_depth"] == 0
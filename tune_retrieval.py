@@ -0,0 +1,269 @@
+"""检索参数调优：在 chunk_size / chunk_overlap / k 网格上重建索引并打分。
+
+用法：
+    python tune_retrieval.py                       # 默认网格，黄金查询取自 data/ 文件名
+    python tune_retrieval.py --chunk-sizes 500 800 1000 --ks 2 3 5
+    python tune_retrieval.py --queries golden.jsonl --dry-run
+    python tune_retrieval.py --calibrate-distance   # 标定 rag_collections.json 的 max_distance
+
+黄金查询文件为 JSONL，每行 {"query": ..., "source": "data/xxx.pdf"}，
+或 {"query": ..., "sources": [...]}（命中任意一个即可）。
+命中率按人设评估：与应用一样传入该人设的集合检索，只计入其集合覆盖的查询，再加权汇总。
+PDF 提取与向量在整个扫描中只计算一次（见 rag_engine.load_documents /
+CachedEmbeddings），同一分块方案下不同的 k 共用一个索引。
+最优配置写入 rag_engine.RAG_CONFIG_PATH，应用启动时读取。
+
+--calibrate-distance 按当前分块配置建索引，对每条黄金查询记录正确来源最优分块的
+全局检索距离，取 --distance-percentile 分位（默认 0.9）写入 rag_engine.RAG_COLLECTIONS_PATH
+的 max_distance：比九成正确答案还远的子索引结果不再算命中，转而用全局结果补足。
+距离尺度随嵌入模型变化，部署前以及更换模型或知识库后都需重新标定；未标定时不过滤。
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from typing import List
+
+import rag_engine as _re
+
+DEFAULT_CHUNK_SIZES = [500, 800, 1000, 1500]
+DEFAULT_CHUNK_OVERLAPS = [100, 200]
+DEFAULT_KS = [2, 3, 4, 5]
+
+# 文件名前的编号，例如 "14-1、"、"10."、"sn1："
+_TITLE_PREFIX_RE = re.compile(r"^(?:sn\d*[：:]|[\d\-]+[、.．]?)\s*", re.IGNORECASE)
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+
+
+def title_from_path(path: str) -> str:
+    """从 PDF 文件名推出论文标题；无意义的文件名（an1、tang2018 等）返回空串。"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    title = _TITLE_PREFIX_RE.sub("", stem).strip()
+    title = re.sub(r"\s+", " ", title)
+    if not _CJK_RE.search(title) and " " not in title:
+        return ""
+    return title
+
+
+def golden_queries_from_titles(file_paths: List[str]) -> List[dict]:
+    """用 data/ 中的论文标题作为查询，期望命中对应的 PDF。
+
+    同名的文件（如 14-1、14-2 预立医疗指示）合并为一条查询，命中其中任意一个都算对。
+    """
+    by_title = {}
+    for path in sorted(file_paths):
+        title = title_from_path(path)
+        if title:
+            by_title.setdefault(title, []).append(path)
+    return [{"query": title, "sources": sources} for title, sources in by_title.items()]
+
+
+def expected_sources(query: dict) -> List[str]:
+    """黄金查询可写 "source"（单个）或 "sources"（任一命中即可）。"""
+    return query.get("sources") or [query["source"]]
+
+
+def load_golden_queries(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _same_source(a: str, b: str) -> bool:
+    return os.path.normpath(a or "") == os.path.normpath(b or "")
+
+
+def persona_queries(queries: List[dict], collections: List[str]) -> List[dict]:
+    """人设检索时应当能答的查询：期望来源至少有一个落在该人设的集合里；人设不分区时为全部查询。"""
+    if not collections:
+        return list(queries)
+    wanted = set(collections)
+    return [q for q in queries
+            if any(wanted & set(_re.collections_for_source(src)) for src in expected_sources(q))]
+
+
+def _run_queries(retriever, queries: List[dict], k: int, collections: List[str] = None):
+    # 先不计时跑一遍，让查询向量进入 LRU；计时只覆盖向量检索，各配置之间可比
+    for q in queries:
+        retriever.get_relevant_documents(q["query"], collections=collections)
+
+    hits, latencies, tokens = 0, [], []
+    for q in queries:
+        start = time.perf_counter()
+        docs = retriever.get_relevant_documents(q["query"], collections=collections)[:k]
+        latencies.append((time.perf_counter() - start) * 1000)
+        if any(_same_source(d.metadata.get("source"), src) for d in docs for src in expected_sources(q)):
+            hits += 1
+        tokens.append(_re.estimate_tokens("\n".join(d.page_content for d in docs)))
+    return hits, latencies, tokens
+
+
+def evaluate(retriever, queries: List[dict], k: int) -> dict:
+    """按人设跑黄金查询（与应用一样传入 persona_collections），汇总命中率、检索延迟和上下文 token。
+
+    每个人设只计入其集合覆盖的查询，汇总按查询数加权；未配置人设分区时全局检索全部查询。
+    """
+    personas = list(_re.RAG_COLLECTIONS["personas"]) or [None]
+    hits, latencies, tokens, total, by_persona = 0, [], [], 0, {}
+    for name in personas:
+        collections = _re.persona_collections(name) if name else None
+        subset = persona_queries(queries, collections)
+        if not subset:
+            continue
+        h, lat, tok = _run_queries(retriever, subset, k, collections)
+        hits, total = hits + h, total + len(subset)
+        latencies.extend(lat)
+        tokens.extend(tok)
+        if name:
+            by_persona[name] = h / len(subset)
+
+    latencies.sort()
+    return {
+        "hit_rate": hits / total if total else 0.0,
+        "latency_ms_p50": statistics.median(latencies) if latencies else 0.0,
+        "latency_ms_p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        "context_tokens": statistics.mean(tokens) if tokens else 0.0,
+        "hit_rate_by_persona": by_persona,
+    }
+
+
+def correct_source_distances(retriever, queries: List[dict], depth: int = 50) -> List[float]:
+    """每条查询在全局索引中正确来源最优分块的距离；前 depth 个结果中没有正确来源的跳过。"""
+    distances = []
+    for q in queries:
+        for d, distance in retriever.global_search(q["query"], depth):
+            if any(_same_source(d.metadata.get("source"), src) for src in expected_sources(q)):
+                distances.append(float(distance))
+                break
+    return distances
+
+
+def calibrate_distance(file_paths: List[str], queries: List[dict], percentile: float) -> dict:
+    splits = _re.load_and_split_documents(file_paths)
+    retriever = _re.get_vector_store_and_retriever(splits, _re.splits_digest(splits)) if splits else None
+    if retriever is None:
+        raise SystemExit("Could not build the retriever.")
+    distances = sorted(correct_source_distances(retriever, queries))
+    if not distances:
+        raise SystemExit("No golden query found its source; cannot calibrate.")
+    max_distance = distances[min(len(distances) - 1, int(round(percentile * (len(distances) - 1))))]
+    print(f"{len(distances)}/{len(queries)} queries found their source; "
+          f"distance p50={statistics.median(distances):.4f} p{percentile * 100:.0f}={max_distance:.4f}")
+    return {"max_distance": round(max_distance, 4), "samples": len(distances)}
+
+
+def write_max_distance(path: str, max_distance: float):
+    """只改 max_distance，保留分区配置里的其它键和手写的排版。"""
+    data, text = {}, ""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        data = json.loads(text)
+    pattern = re.compile(r'("max_distance"\s*:\s*)[^,\n}]+')
+    if len(pattern.findall(text)) == 1:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(pattern.sub(lambda m: m.group(1) + json.dumps(max_distance), text))
+        return
+    data["max_distance"] = max_distance
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def pick_best(results: List[dict], max_context_tokens: int = None) -> dict:
+    """命中率优先；其次上下文更短；再其次检索更快。"""
+    candidates = [r for r in results if not max_context_tokens or r["context_tokens"] <= max_context_tokens]
+    if not candidates:
+        candidates = results
+    return max(candidates, key=lambda r: (round(r["hit_rate"], 4), -r["context_tokens"], -r["latency_ms_p50"]))
+
+
+def sweep(file_paths: List[str], queries: List[dict], chunk_sizes, chunk_overlaps, ks) -> List[dict]:
+    documents = _re.load_documents(file_paths)
+    if not documents:
+        return []
+
+    results = []
+    for chunk_size in chunk_sizes:
+        for chunk_overlap in chunk_overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+            splits = _re.split_documents(documents, chunk_size, chunk_overlap)
+            key = _re.splits_digest(splits)
+            build_start = time.perf_counter()
+            # 以最大 k 建一次索引，较小的 k 直接截断结果
+            retriever = _re.get_vector_store_and_retriever(splits, key, max(ks))
+            build_s = time.perf_counter() - build_start
+            if retriever is None:
+                continue
+            for k in ks:
+                row = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "k": k,
+                       "chunks": len(splits), "build_s": build_s}
+                row.update(evaluate(retriever, queries, k))
+                results.append(row)
+                per_persona = " ".join(f"{name}={rate:.2f}" for name, rate in row["hit_rate_by_persona"].items())
+                print(f"chunk_size={chunk_size:<5} overlap={chunk_overlap:<4} k={k:<2} "
+                      f"hit={row['hit_rate']:.2f} p50={row['latency_ms_p50']:.1f}ms "
+                      f"ctx={row['context_tokens']:.0f}tok chunks={len(splits)} build={build_s:.1f}s"
+                      + (f" [{per_persona}]" if per_persona else ""))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking and k for the RAG retriever.")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=DEFAULT_CHUNK_SIZES)
+    parser.add_argument("--chunk-overlaps", type=int, nargs="+", default=DEFAULT_CHUNK_OVERLAPS)
+    parser.add_argument("--ks", type=int, nargs="+", default=DEFAULT_KS)
+    parser.add_argument("--queries", help="JSONL golden queries; defaults to titles of data/ PDFs")
+    parser.add_argument("--max-context-tokens", type=int, help="Ignore configurations above this per-turn budget")
+    parser.add_argument("--output", default=_re.RAG_CONFIG_PATH, help="Where to write the winning config")
+    parser.add_argument("--report", help="Optional JSON file for the full result table")
+    parser.add_argument("--dry-run", action="store_true", help="Print the winner without writing the config")
+    parser.add_argument("--calibrate-distance", action="store_true",
+                        help="Instead of sweeping, calibrate max_distance in the collections config")
+    parser.add_argument("--distance-percentile", type=float, default=0.9,
+                        help="Percentile of correct-source distances used as max_distance")
+    args = parser.parse_args()
+
+    if os.getenv("RAG_USE_RANDOM_EMBEDDINGS") == "1":
+        print("Warning: RAG_USE_RANDOM_EMBEDDINGS=1, scores are meaningless in dev mode.")
+
+    file_paths = _re.get_backend_pdfs()
+    if not file_paths:
+        raise SystemExit(f"No PDF files found in '{_re.BACKEND_KB_DIR}/'.")
+    queries = load_golden_queries(args.queries) if args.queries else golden_queries_from_titles(file_paths)
+    if not queries:
+        raise SystemExit("No golden queries.")
+    print(f"{len(file_paths)} PDFs, {len(queries)} golden queries.")
+
+    if args.calibrate_distance:
+        result = calibrate_distance(file_paths, queries, args.distance_percentile)
+        print(f"max_distance = {result['max_distance']}")
+        if not args.dry_run:
+            write_max_distance(_re.RAG_COLLECTIONS_PATH, result["max_distance"])
+            print(f"Wrote {_re.RAG_COLLECTIONS_PATH}")
+        return
+
+    results = sweep(file_paths, queries, args.chunk_sizes, args.chunk_overlaps, args.ks)
+    if not results:
+        raise SystemExit("No configuration could be evaluated.")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    best = pick_best(results, args.max_context_tokens)
+    config = {key: best[key] for key in _re.RAG_DEFAULTS}
+    config["metrics"] = {key: best[key] for key in ("hit_rate", "hit_rate_by_persona", "latency_ms_p50", "context_tokens")}
+    config["tuned_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    print(f"Best: {json.dumps(config, ensure_ascii=False)}")
+
+    if not args.dry_run:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()